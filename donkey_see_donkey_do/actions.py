@@ -0,0 +1,72 @@
+from datetime import timedelta
+from typing import List
+
+from donkey_see_donkey_do.events import ClickEvent, Events, KeyboardEvent, ScrollEvent, StateSnapshotEvent
+
+
+def _keyboard_event_to_action(event: KeyboardEvent, start_offset: timedelta) -> dict:
+    return {
+        "device": event.device,
+        "start": start_offset,
+        "key_actions": [(key, action, action_ts - event.timestamp) for key, action, action_ts in event.key_actions],
+    }
+
+
+def _scroll_event_to_action(event: ScrollEvent, start_offset: timedelta) -> dict:
+    return {
+        "device": event.device,
+        "start": start_offset,
+        "action": event.action,
+        "location": event.location,
+        "scroll_actions": [(change.scroll, change.timestamp - event.timestamp) for change in event.scroll_actions],
+        "duration": event.last_action_timestamp - event.timestamp,
+    }
+
+
+def _click_event_to_action(event: ClickEvent, start_offset: timedelta) -> dict:
+    return {
+        "device": event.device,
+        "start": start_offset,
+        "action": event.action,
+        "location": event.location,
+        "button": event.button,
+    }
+
+
+def _state_snapshot_event_to_action(event: StateSnapshotEvent, start_offset: timedelta) -> dict:
+    return {
+        "device": event.device,
+        "start": start_offset,
+        "location": event.location,
+    }
+
+
+_EVENT_TO_ACTION = {
+    KeyboardEvent: _keyboard_event_to_action,
+    ScrollEvent: _scroll_event_to_action,
+    ClickEvent: _click_event_to_action,
+    StateSnapshotEvent: _state_snapshot_event_to_action,
+}
+
+
+def _get_event_to_action(event_type: type):
+    try:
+        return _EVENT_TO_ACTION[event_type]
+    except KeyError:
+        pass
+
+    for base_type, to_action in list(_EVENT_TO_ACTION.items()):
+        if issubclass(event_type, base_type):
+            _EVENT_TO_ACTION[event_type] = to_action
+            return to_action
+
+    raise TypeError(f"Unrecognized event type: {event_type}")
+
+
+def events_to_actions_using_location(events: Events) -> List[dict]:
+    actions = []
+    start_time = events[0].timestamp
+    for event in events:
+        to_action = _get_event_to_action(type(event))
+        actions.append(to_action(event, event.timestamp - start_time))
+    return actions
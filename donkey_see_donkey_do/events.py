@@ -1,11 +1,16 @@
-import base64
-import json
+import atexit
+import os
+import threading
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass
 from datetime import datetime
 from io import BytesIO
 from pathlib import Path
-from typing import List, Literal, Optional, Tuple, Union
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Literal, NamedTuple, Optional, Tuple, Union
 
+import msgpack
+import orjson
 import pydantic
 from PIL import Image
 from pin_the_tail.interaction import MouseButton
@@ -13,46 +18,204 @@ from pin_the_tail.location import Point
 from pydantic import BaseModel, Field
 from pynput import keyboard, mouse
 
+try:
+    # SIMD-accelerated drop-in replacement for the standard library's base64
+    import pybase64 as base64
+except ImportError:
+    import base64
+
 KeyType = Union[keyboard.Key, str]
 
+MSGPACK_EXT_IMAGE = 1
+MSGPACK_EXT_KEY = 2
+
+# zlib level used when PNG-encoding screenshots, both for serialization and when recorders save them to disk: 1 is
+# several times faster to encode than Pillow's default of 6, at the cost of somewhat larger files.  Raise it if file size
+# matters more than encoding time; files can also be recompressed offline (e.g. with oxipng) after recording.
+PNG_COMPRESS_LEVEL = 1
+
+_PYNPUT_BUTTONS = dict(mouse.Button.__members__)
+_PIN_THE_TAIL_BUTTONS = {button.value: button for button in MouseButton}
+
+
+# How a base64-encoded PNG starts.  Older JSON files stored screenshots as bare base64 strings, which this tells apart
+# from screenshots saved as paths.
+_BASE64_PNG_SIGNATURE = "iVBORw0KGgo"
+
+# PNG encodings of live images, keyed by ``id()`` because images aren't hashable.  Each entry is evicted when its image
+# is garbage collected, before the id can be reused.
+_png_cache = {}  # type: Dict[int, bytes]
+
+
+def _encode_png(image: Image.Image) -> bytes:
+    buffer = BytesIO()
+    image.save(buffer, format="PNG", compress_level=PNG_COMPRESS_LEVEL, optimize=False)
+    return buffer.getvalue()
+
+
+def _image_to_png(image: Image.Image) -> bytes:
+    """
+    PNG-encode ``image``, reusing the previous encoding if the same image was already encoded.
+
+    Screenshots aren't modified after they're taken, so serializing the same events repeatedly only pays for encoding
+    each screenshot once.
+    """
+    key = id(image)
+    try:
+        return _png_cache[key]
+    except KeyError:
+        pass
+
+    png = _encode_png(image)
+    _png_cache[key] = png
+    weakref.finalize(image, _png_cache.pop, key, None)
+    return png
+
+
+def _image_to_png_uncached(image: Image.Image) -> bytes:
+    """
+    Like ``_image_to_png``, but a new encoding isn't kept in the cache.
+    """
+    png = _png_cache.get(id(image))
+    return _encode_png(image) if png is None else png
+
+
+def model_json_dumps_bytes(val, *, default, pngs: Optional[Dict[int, bytes]] = None) -> bytes:
+    """
+    Serialize ``val`` to JSON.  ``pngs`` optionally maps ``id()`` of images to their already-encoded PNG bytes.
+    """
 
-def model_json_dumps(val, *, default):
     def basic_default(value):
         if isinstance(value, Image.Image):
-            buffer = BytesIO()
-            value.save(buffer, format="PNG")
-            return base64.b64encode(buffer.getvalue()).decode("ascii")
-        if isinstance(value, keyboard.Key):
-            return {"donkey_see_donkey_do": None, "type": "key", "key": value.name}
+            png = pngs.get(id(value)) if pngs else None
+            if png is None:
+                png = _image_to_png(value)
+            return {"donkey_see_donkey_do": None, "type": "image", "png": base64.b64encode(png).decode("ascii")}
+        if isinstance(value, keyboard.KeyCode):
+            # orjson serializes enums natively by their value, so a ``keyboard.Key`` arrives here as its ``KeyCode``
+            try:
+                return {"donkey_see_donkey_do": None, "type": "key", "key": keyboard.Key(value).name}
+            except ValueError:
+                pass
+        if isinstance(value, tuple):
+            # orjson doesn't serialize tuple subclasses (e.g. ``PointChange``)
+            return list(value)
         return default(value)
 
-    return json.dumps(val, default=basic_default)
+    return orjson.dumps(val, default=basic_default)
+
+
+def model_json_dumps(val, *, default) -> str:
+    return model_json_dumps_bytes(val, default=default).decode("utf-8")
+
+
+def _decode_png(value: str) -> Image.Image:
+    # BytesIO shares the decoded bytes rather than copying them
+    return Image.open(BytesIO(base64.b64decode(value)), formats=("PNG",))
+
+
+def _decode_json_sentinel(value: dict):
+    if value["type"] == "image":
+        return _decode_png(value["png"])
+    if value["type"] == "key":
+        return keyboard.Key[value["key"]]
+    raise ValueError(f"Unrecognized type: {value['type']}")
+
+
+def _decode_json_values(data: list) -> None:
+    """
+    Replace the sentinel objects written by ``model_json_dumps`` (images and keys) with the values they encode, as well
+    as screenshots written as bare base64 strings by older versions.
+
+    Containers are updated in place, walking them with an explicit stack; only dicts and lists are descended into.
+    """
+    stack = [data]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            children = enumerate(node)
+        else:
+            screenshot = node.get("screenshot")
+            if isinstance(screenshot, str) and screenshot.startswith(_BASE64_PNG_SIGNATURE):
+                node["screenshot"] = _decode_png(screenshot)
+            children = node.items()
+
+        for key, value in children:
+            if isinstance(value, dict):
+                if "donkey_see_donkey_do" in value:
+                    node[key] = _decode_json_sentinel(value)
+                else:
+                    stack.append(value)
+            elif isinstance(value, list):
+                stack.append(value)
 
 
 def model_json_loads(value):
-    def obj_hook(val):
-        screenshot = val.get("screenshot")
-        if screenshot is not None:
-            buffer = BytesIO()
-            buffer.write(base64.b64decode(screenshot.encode("ascii")))
-            val["screenshot"] = Image.open(buffer, formats=("PNG",))
-
-        if "donkey_see_donkey_do" in val:
-            if val["type"] == "key":
-                val = keyboard.Key[val["key"]]
-            else:
-                raise ValueError(f"Unrecognized type: {val['type']}")
+    # orjson has no object_hook, so special values are decoded afterwards.  Wrapping the result in a list lets a
+    # top-level sentinel be replaced like any other.
+    root = [orjson.loads(value)]
+    _decode_json_values(root)
+    return root[0]
 
-        return val
 
-    return json.loads(value, object_hook=obj_hook)
+def model_msgpack_dumps(val, *, default) -> bytes:
+    """
+    Serialize ``val`` to MessagePack.
+
+    Images are stored as raw PNG bytes and special keys by name, each in their own extension type, so neither needs to
+    be base64-encoded the way the JSON format requires.
+    """
 
+    def basic_default(value):
+        if isinstance(value, Image.Image):
+            return msgpack.ExtType(MSGPACK_EXT_IMAGE, _image_to_png(value))
+        if isinstance(value, keyboard.Key):
+            return msgpack.ExtType(MSGPACK_EXT_KEY, value.name.encode("utf-8"))
+        return default(value)
 
-@dataclass(frozen=True)
-class PointChange:
+    return msgpack.packb(val, default=basic_default, use_bin_type=True)
+
+
+def model_msgpack_loads(value: bytes):
+    def ext_hook(code: int, data: bytes):
+        if code == MSGPACK_EXT_IMAGE:
+            return Image.open(BytesIO(data), formats=("PNG",))
+        if code == MSGPACK_EXT_KEY:
+            return keyboard.Key[data.decode("utf-8")]
+        raise ValueError(f"Unrecognized extension type: {code}")
+
+    return msgpack.unpackb(value, ext_hook=ext_hook, raw=False)
+
+
+class PointChange(NamedTuple):
     dx: int
     dy: int
 
+    @classmethod
+    def __get_validators__(cls):
+        yield cls.validate
+
+    @classmethod
+    def validate(cls, value) -> "PointChange":
+        """
+        Accept a ``PointChange``, a ``(dx, dy)`` pair, or the ``{"dx": ..., "dy": ...}`` mapping older recordings used.
+        """
+        if isinstance(value, cls):
+            return value
+
+        if isinstance(value, dict):
+            if value.keys() != {"dx", "dy"}:
+                raise ValueError(f"scroll must have exactly the keys dx and dy; received {value!r}")
+            dx, dy = value["dx"], value["dy"]
+        elif isinstance(value, (list, tuple)):
+            if len(value) != 2:
+                raise ValueError(f"scroll must be a (dx, dy) pair; received {value!r}")
+            dx, dy = value
+        else:
+            raise TypeError(f"scroll must be a PointChange, a (dx, dy) pair, or a mapping; received {value!r}")
+
+        return cls(int(dx), int(dy))
+
 
 @dataclass
 class ScrollChange:
@@ -74,6 +237,7 @@ class BaseEvent(BaseModel):
 
     class Config:
         arbitrary_types_allowed = True
+        copy_on_model_validation = "none"
         json_loads = model_json_loads
         json_dumps = model_json_dumps
 
@@ -95,6 +259,10 @@ class MouseEvent(BaseEvent):
 
     @pydantic.validator("location")
     def convert_location_to_point(cls, value) -> Point:
+        if type(value) is Point:  # pylint: disable=unidiomatic-typecheck
+            # Fast path for the common case: an exact Point needs no conversion or further checks
+            return value
+
         if isinstance(value, (list, tuple)):
             if len(value) == 2:
                 value = Point.from_tuple(value)
@@ -113,19 +281,24 @@ class ClickEvent(MouseEvent):
 
     @property
     def _pynput_button(self) -> mouse.Button:
-        return mouse.Button[self.button]
+        return _PYNPUT_BUTTONS[self.button]
 
     @property
     def pin_the_tail_button(self) -> MouseButton:
-        return MouseButton(self.button)
+        try:
+            return _PIN_THE_TAIL_BUTTONS[self.button]
+        except KeyError:
+            return MouseButton(self.button)
 
 
 class ScrollEvent(MouseEvent):
     action: Literal["scroll"] = "scroll"
     scroll_actions: List[ScrollChange] = Field(default_factory=list)
 
-    def append_action(self, dx: int, dy: int) -> None:
-        self.scroll_actions.append(ScrollChange(PointChange(dx, dy), datetime.now()))
+    def append_action(self, dx: int, dy: int, timestamp: Optional[datetime] = None) -> None:
+        if timestamp is None:
+            timestamp = datetime.now()
+        self.scroll_actions.append(ScrollChange(PointChange(dx, dy), timestamp))
 
     @property
     def last_action_timestamp(self) -> datetime:
@@ -136,26 +309,183 @@ class KeyboardEvent(BaseEvent):
     device: Literal["keyboard"] = "keyboard"
     key_actions: List[Tuple[KeyType, Literal["press", "release", "write"], datetime]] = Field(default_factory=list)
 
-    def append_action(self, key: KeyType, action: Literal["press", "release", "write"]) -> None:
-        self.key_actions.append((key, action, datetime.now()))
+    def append_action(
+        self, key: KeyType, action: Literal["press", "release", "write"], timestamp: Optional[datetime] = None
+    ) -> None:
+        if timestamp is None:
+            timestamp = datetime.now()
+        self.key_actions.append((key, action, timestamp))
 
 
 RealEventsType = Union[StateSnapshotEvent, ClickEvent, ScrollEvent, KeyboardEvent]
 
 
 class Events(BaseModel):
+    """
+    An ordered collection of events.
+
+    Events are only validated when loaded (e.g. ``parse_file``, ``parse_raw``, ``parse_msgpack``).  ``append``,
+    ``extend``, and ``from_iterable`` store already-built events as-is.
+    """
+
     __root__: List[RealEventsType] = Field(default_factory=list)
 
+    @classmethod
+    def from_iterable(cls, iterable: Iterable[RealEventsType]) -> "Events":
+        return cls.construct(__root__=list(iterable))
+
     def __len__(self) -> int:
         return len(self.__root__)
 
+    def __iter__(self) -> Iterator[RealEventsType]:
+        return iter(self.__root__)
+
     def append(self, item: RealEventsType) -> None:
         self.__root__.append(item)
 
+    def extend(self, items: Iterable[RealEventsType]) -> None:
+        self.__root__.extend(items)
+
     def __getitem__(self, item: int) -> RealEventsType:
         return self.__root__[item]
 
+    def msgpack(self) -> bytes:
+        """
+        Serialize the events to MessagePack, a more compact and faster alternative to ``json()``.
+        """
+        return model_msgpack_dumps(self.dict()["__root__"], default=self.__json_encoder__)
+
+    @classmethod
+    def parse_msgpack(cls, data: bytes) -> "Events":
+        """
+        Load events serialized with ``msgpack()``.  Data produced by ``json()`` is also accepted.
+        """
+        if data[:1] in (b"[", b"{"):
+            return cls.parse_raw(data)
+        return cls.parse_obj(model_msgpack_loads(data))
+
+    def write_json(self, fp: BinaryIO, max_workers: Optional[int] = None) -> None:
+        """
+        Write the events to the binary file ``fp`` as JSON, the same document ``json()`` produces.  Events are encoded
+        and written one at a time, so the whole document is never held in memory.
+
+        While an event is written, a pool of ``max_workers`` threads PNG-encodes the screenshots of the next few events
+        (Pillow releases the GIL while encoding), so multiple cores share the most expensive part of serialization.
+        Each encoding is dropped once the last event using it has been written.
+        """
+        events = self.__root__
+        screenshots = [event.screenshot if isinstance(event.screenshot, Image.Image) else None for event in events]
+        last_use = {id(screenshot): i for i, screenshot in enumerate(screenshots) if screenshot is not None}
+        prefetch = 2 * (max_workers or os.cpu_count() or 1)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            encodings = {}  # type: Dict[int, Future]
+            submitted = 0
+
+            fp.write(b"[")
+            for i, event in enumerate(events):
+                while submitted < min(len(events), i + prefetch):
+                    screenshot = screenshots[submitted]
+                    if screenshot is not None and id(screenshot) not in encodings:
+                        encodings[id(screenshot)] = executor.submit(_image_to_png_uncached, screenshot)
+                    submitted += 1
+
+                pngs = None
+                screenshot = screenshots[i]
+                if screenshot is not None:
+                    key = id(screenshot)
+                    pngs = {key: encodings[key].result()}
+                    if last_use[key] == i:
+                        del encodings[key]
+
+                if i > 0:
+                    fp.write(b",")
+                fp.write(model_json_dumps_bytes(event.dict(), default=event.__json_encoder__, pngs=pngs))
+            fp.write(b"]")
+
+    def to_json_file(self, filepath: Path) -> None:
+        """
+        Write the events to ``filepath`` using ``write_json``.  Load it with ``parse_file``.
+        """
+        with open(filepath, "wb") as fp:
+            self.write_json(fp)
+
+    @classmethod
+    def parse_jsonl_file(cls, filepath: Path) -> "Events":
+        """
+        Load events written by ``EventsWriter``, one JSON-encoded event per line.
+        """
+        with open(filepath, "rb") as fp:
+            return cls.parse_obj([model_json_loads(line) for line in fp if line.strip()])
+
     class Config:
         arbitrary_types_allowed = True
         json_loads = model_json_loads
         json_dumps = model_json_dumps
+
+
+class EventsWriter:
+    """
+    Append events to a JSON Lines file, one event per line.
+
+    Writes are buffered and only flushed to disk once ``max_events`` events are pending or ``max_interval`` seconds have
+    passed since the oldest pending event was written, so a burst of events doesn't pay for a flush (and ``fsync``) per
+    event.  The interval is kept by a timer, so pending events are flushed on time even if no more events are written.
+    Any pending events are flushed when the writer is closed, or at interpreter exit if it never was.
+    """
+
+    def __init__(self, filepath: Path, max_events: int = 256, max_interval: float = 0.5):
+        self.max_events = max_events
+        self.max_interval = max_interval
+
+        self._fp = open(filepath, "ab", buffering=1 << 20)  # pylint: disable=consider-using-with
+        self._pending_count = 0
+        self._flush_timer = None  # type: Optional[threading.Timer]
+        # The flush timer runs on its own thread
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    def write(self, event: BaseEvent) -> None:
+        line = model_json_dumps_bytes(event.dict(), default=event.__json_encoder__) + b"\n"
+        with self._lock:
+            self._fp.write(line)
+            self._pending_count += 1
+
+            if self._pending_count >= self.max_events:
+                self._flush()
+            elif self._flush_timer is None:
+                self._flush_timer = threading.Timer(self.max_interval, self.flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush()
+
+    def _flush(self) -> None:
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+
+        if self._fp.closed:
+            # A timer that fired just as the writer was closed
+            return
+
+        self._fp.flush()
+        os.fsync(self._fp.fileno())
+        self._pending_count = 0
+
+    def close(self) -> None:
+        with self._lock:
+            if self._fp.closed:
+                return
+
+            self._flush()
+            self._fp.close()
+        atexit.unregister(self.close)
+
+    def __enter__(self) -> "EventsWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
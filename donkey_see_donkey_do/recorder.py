@@ -1,31 +1,154 @@
-from datetime import datetime
+import hashlib
+import logging
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Optional, Union
+from typing import List, Literal, Optional, Union
 
 import pyautogui
-from apscheduler.schedulers.background import BackgroundScheduler
 from PIL import Image
+from pin_the_tail.location import Point
 from pynput import keyboard, mouse
 from pynput.mouse import Button
 
-from donkey_see_donkey_do.events import ClickEvent, Events, KeyboardEvent, KeyType, ScrollEvent, StateSnapshotEvent
+# Re-exported: the action conversion used to live in this module
+from donkey_see_donkey_do.actions import events_to_actions_using_location  # noqa: F401
+from donkey_see_donkey_do.events import (
+    PNG_COMPRESS_LEVEL,
+    ClickEvent,
+    Events,
+    EventsWriter,
+    KeyboardEvent,
+    KeyType,
+    ScrollEvent,
+    StateSnapshotEvent,
+)
+
+try:
+    # Grabs the screen directly through the platform's APIs, much faster than pyautogui's screenshot helpers
+    import mss
+    import mss.tools
+except ImportError:
+    mss = None
+
+logger = logging.getLogger(__name__)
+
+ScreenshotFormat = Literal["png", "jpeg"]
+
+# Encoder settings for screenshots saved to disk, by format
+_SCREENSHOT_SAVE_OPTIONS = {
+    "png": {"format": "PNG", "compress_level": PNG_COMPRESS_LEVEL, "optimize": False},
+    "jpeg": {"format": "JPEG", "quality": 85, "optimize": False},
+}
+
+_SCREENSHOT_EXTENSIONS = {"png": ".png", "jpeg": ".jpg"}
 
 
 class BaseRecorder:
-    def __init__(self, take_screenshot: bool = True, screenshot_directory: Optional[Path] = None):
+    """
+    Base for the callables that turn input into events.
+
+    Events are built with pydantic's ``construct``, which skips validation: every value comes straight from the input
+    listeners or the screen grabber and already has the right type.
+
+    If ``screenshot_max_age`` is greater than zero, a screenshot is reused for any event within that many seconds of
+    when it was taken, rather than taking a new one.  A burst of input (e.g. typing a word) then shares one screenshot
+    instead of capturing the screen for each event.
+
+    Screenshots saved to ``screenshot_directory`` are PNG files by default.  Setting ``screenshot_format`` to ``"jpeg"``
+    saves them as JPEG instead, which is much faster to encode and smaller on disk, but lossy.
+
+    A screenshot identical to the previous one (e.g. nothing changed on screen between state snapshots) isn't kept or
+    saved again; the previous screenshot (image or file) is reused instead.
+    """
+
+    def __init__(
+        self,
+        take_screenshot: bool = True,
+        screenshot_directory: Optional[Path] = None,
+        screenshot_max_age: float = 0,
+        screenshot_format: ScreenshotFormat = "png",
+    ):
+        if screenshot_format not in _SCREENSHOT_SAVE_OPTIONS:
+            raise ValueError(f"Unsupported screenshot format: {screenshot_format!r}")
+
         self.take_screenshot = take_screenshot
         self.screenshot_directory = screenshot_directory
+        self.screenshot_max_age = screenshot_max_age
+        self.screenshot_format = screenshot_format
+
+        self.reset()
+
+        # mss instances must only be used by the thread that created them
+        self._mss_local = threading.local()
+
+    def reset(self) -> None:
+        """
+        Forget the previous screenshot, so it isn't reused for later events (e.g. in a new recording).
+        """
+        self._last_screenshot = None  # type: Optional[Union[Path, Image.Image]]
+        self._last_screenshot_time = 0.0
+        self._last_screenshot_digest = None  # type: Optional[bytes]
+
+    def _grab_raw(self):
+        grabber = getattr(self._mss_local, "grabber", None)
+        if grabber is None:
+            grabber = self._mss_local.grabber = mss.mss()
+
+        # The primary monitor, like pyautogui: monitors[0] spans every monitor and may start at a negative offset, so
+        # its pixels wouldn't line up with event locations
+        return grabber.grab(grabber.monitors[1])
+
+    def close_screen_grabber(self) -> None:
+        """
+        Close the screen grabber used by the calling thread, if it has one.
+        """
+        grabber = getattr(self._mss_local, "grabber", None)
+        if grabber is not None:
+            grabber.close()
+            del self._mss_local.grabber
 
     def get_screenshot(self) -> Optional[Union[Path, Image.Image]]:
         if not self.take_screenshot:
             return None
 
-        screenshot = pyautogui.screenshot()
+        now = time.monotonic()
+        if self._last_screenshot is not None and now - self._last_screenshot_time < self.screenshot_max_age:
+            return self._last_screenshot
+
+        self._last_screenshot = self._capture_screenshot()
+        self._last_screenshot_time = now
+        return self._last_screenshot
+
+    def _capture_screenshot(self) -> Union[Path, Image.Image]:
+        if mss is None:
+            raw = None
+            image = pyautogui.screenshot()
+        else:
+            raw = self._grab_raw()
+            image = None
+
+        # Hashing the pixels is far cheaper than encoding (or keeping) another copy of an unchanged screen
+        digest = hashlib.blake2b(image.tobytes() if raw is None else raw.raw, digest_size=16).digest()
+        if digest == self._last_screenshot_digest and self._last_screenshot is not None:
+            return self._last_screenshot
+        self._last_screenshot_digest = digest
+
+        # mss can write PNG files itself, so only build a PIL image when it's needed
+        if image is None and (self.screenshot_directory is None or self.screenshot_format != "png"):
+            image = Image.frombytes("RGB", raw.size, raw.bgra, "raw", "BGRX")
+
         if self.screenshot_directory is None:
-            return screenshot
+            return image
 
-        output_filepath = self.screenshot_directory / (datetime.now().isoformat() + ".png")
-        screenshot.save(output_filepath)
+        extension = _SCREENSHOT_EXTENSIONS[self.screenshot_format]
+        output_filepath = self.screenshot_directory / (datetime.now().isoformat() + extension)
+        if image is None:
+            mss.tools.to_png(raw.rgb, raw.size, level=PNG_COMPRESS_LEVEL, output=str(output_filepath))
+        else:
+            image.save(output_filepath, **_SCREENSHOT_SAVE_OPTIONS[self.screenshot_format])
         return output_filepath
 
     def __call__(self, *args, **kwargs):
@@ -38,100 +161,166 @@ class StateSnapshotRecorder(BaseRecorder):
         take_screenshot: bool = True,
         screenshot_directory: Optional[Path] = None,
         frequency: Union[int, float] = 1,
+        screenshot_max_age: float = 0,
+        screenshot_format: ScreenshotFormat = "png",
     ):
-        super().__init__(take_screenshot, screenshot_directory)
+        super().__init__(take_screenshot, screenshot_directory, screenshot_max_age, screenshot_format)
         self.frequency = frequency
 
-    def __call__(self, previous_events: Events) -> StateSnapshotEvent:
-        return StateSnapshotEvent(screenshot=self.get_screenshot(), location=pyautogui.position())
+    def __call__(self, previous_events: Events, timestamp: Optional[datetime] = None) -> StateSnapshotEvent:
+        timestamp = timestamp or datetime.now()
+        return StateSnapshotEvent.construct(
+            timestamp=timestamp, screenshot=self.get_screenshot(), location=Point.from_tuple(pyautogui.position())
+        )
 
 
 class ClickRecorder(BaseRecorder):
-    def __call__(self, x: int, y: int, button: Button, is_press: bool, previous_events: Events) -> ClickEvent:
-        return ClickEvent(
+    def __call__(
+        self,
+        x: int,
+        y: int,
+        button: Button,
+        is_press: bool,
+        previous_events: Events,
+        timestamp: Optional[datetime] = None,
+    ) -> ClickEvent:
+        return ClickEvent.construct(
+            timestamp=timestamp or datetime.now(),
             action="press" if is_press else "release",
             button=button.name,
-            location=(x, y),
+            location=Point(x, y),
             screenshot=self.get_screenshot(),
         )
 
 
-class ScrollRecorder(BaseRecorder):
+class BaseMergingRecorder(BaseRecorder):
+    """
+    Base for recorders that merge an event into the previous one when it happens within ``seconds_to_merge`` seconds.
+    """
+
     def __init__(
-        self, take_screenshot: bool = True, screenshot_directory: Optional[Path] = None, seconds_to_merge: float = 1
+        self,
+        take_screenshot: bool = True,
+        screenshot_directory: Optional[Path] = None,
+        seconds_to_merge: float = 1,
+        screenshot_max_age: float = 0,
+        screenshot_format: ScreenshotFormat = "png",
     ):
-        super().__init__(take_screenshot, screenshot_directory)
+        super().__init__(take_screenshot, screenshot_directory, screenshot_max_age, screenshot_format)
         self.seconds_to_merge = seconds_to_merge
 
-    def merge_with_previous_event(self, x: int, y: int, dx: int, dy: int, previous_events: Events) -> bool:
+    @property
+    def seconds_to_merge(self) -> float:
+        return self._merge_window.total_seconds()
+
+    @seconds_to_merge.setter
+    def seconds_to_merge(self, value: float) -> None:
+        # Kept as a timedelta so checks compare against it directly instead of calling total_seconds() per event
+        self._merge_window = timedelta(seconds=value)
+
+
+class ScrollRecorder(BaseMergingRecorder):
+    def merge_with_previous_event(
+        self, x: int, y: int, dx: int, dy: int, previous_events: Events, timestamp: Optional[datetime] = None
+    ) -> bool:
         if len(previous_events) == 0:
             return False
 
         previous_event = previous_events[-1]
         return (
             isinstance(previous_event, ScrollEvent)
-            and (datetime.now() - previous_event.timestamp).total_seconds() < self.seconds_to_merge
+            and (timestamp or datetime.now()) - previous_event.timestamp < self._merge_window
             and previous_event.location == (x, y)  # for now, require the mouse to be in the same position
         )
 
-    def __call__(self, x: int, y: int, dx: int, dy: int, previous_events: Events) -> Optional[ScrollEvent]:
-        if self.merge_with_previous_event(x, y, dx, dy, previous_events):
-            previous_events[-1].append_action(dx, dy)
+    def __call__(
+        self, x: int, y: int, dx: int, dy: int, previous_events: Events, timestamp: Optional[datetime] = None
+    ) -> Optional[ScrollEvent]:
+        timestamp = timestamp or datetime.now()
+        if self.merge_with_previous_event(x, y, dx, dy, previous_events, timestamp):
+            previous_events[-1].append_action(dx, dy, timestamp)
             return None
 
-        event = ScrollEvent(location=(x, y), screenshot=self.get_screenshot())
-        event.append_action(dx, dy)
+        event = ScrollEvent.construct(timestamp=timestamp, location=Point(x, y), screenshot=self.get_screenshot())
+        event.append_action(dx, dy, timestamp)
         return event
 
 
-class KeyboardRecorder(BaseRecorder):
-    def __init__(
-        self, take_screenshot: bool = True, screenshot_directory: Optional[Path] = None, seconds_to_merge: float = 1
-    ):
-        super().__init__(take_screenshot, screenshot_directory)
-        self.seconds_to_merge = seconds_to_merge
-
-    def merge_with_previous_event(self, previous_events: Events) -> bool:
+class KeyboardRecorder(BaseMergingRecorder):
+    def merge_with_previous_event(self, previous_events: Events, timestamp: Optional[datetime] = None) -> bool:
         if len(previous_events) == 0:
             return False
 
         previous_event = previous_events[-1]
-        return isinstance(previous_event, KeyboardEvent) and (
-            (datetime.now() - previous_event.timestamp).total_seconds() < self.seconds_to_merge
+        return (
+            isinstance(previous_event, KeyboardEvent)
+            and (timestamp or datetime.now()) - previous_event.timestamp < self._merge_window
         )
 
-    def __call__(self, key: KeyType, is_press: bool, previous_events: Events) -> Optional[KeyboardEvent]:
+    def __call__(
+        self, key: KeyType, is_press: bool, previous_events: Events, timestamp: Optional[datetime] = None
+    ) -> Optional[KeyboardEvent]:
+        timestamp = timestamp or datetime.now()
         key = key if isinstance(key, keyboard.Key) else str(key)
-        if self.merge_with_previous_event(previous_events):
-            previous_events[-1].append_action(key, "press" if is_press else "release")
+        if self.merge_with_previous_event(previous_events, timestamp):
+            previous_events[-1].append_action(key, "press" if is_press else "release", timestamp)
             return None
 
-        event = KeyboardEvent(screenshot=self.get_screenshot())
-        event.append_action(key, "press" if is_press else "release")
+        event = KeyboardEvent.construct(timestamp=timestamp, screenshot=self.get_screenshot())
+        event.append_action(key, "press" if is_press else "release", timestamp)
         return event
 
 
+# Default for each of ``Recorder``'s recorders, so every ``Recorder`` creates its own instead of sharing (and carrying
+# screenshot state between recordings in) ones created once, when this module is imported.  ``None`` still turns a
+# recorder off.
+_DEFAULT_RECORDER = object()
+
+
 class Recorder:
     """
     Record keyboard and mouse actions
+
+    The input listeners only note what happened and when; events are built (including taking any screenshots) on a
+    separate worker thread, so slow screenshots don't hold up the operating system's input handling or cause inputs to
+    be missed.  Events are also built one at a time, in the order their inputs arrived.  If building an event fails,
+    the error is logged and recording carries on with the next input.
+
+    Each of ``record_click``, ``record_scroll``, ``record_keyboard``, and ``record_state`` may be any callable taking the
+    input's arguments followed by the events recorded so far, and returning a new event or ``None``.  ``BaseRecorder``
+    instances are also passed the time the input arrived, as ``timestamp``, since they're called some time after it.
+
+    If ``stream_to`` is given, events are appended to that file as JSON Lines (see ``Events.parse_jsonl_file``) while
+    recording, instead of being kept in memory.  An event is written once the next one starts, since until then later
+    input may still be merged into it, and the final event is written when recording stops.  Only the latest event is
+    kept in ``recorded_events``, so long recordings don't hold every event (and screenshot) in memory.
     """
 
     def __init__(
         self,
-        record_click=ClickRecorder(),
-        record_scroll=ScrollRecorder(),
-        record_keyboard=KeyboardRecorder(),
-        record_state=StateSnapshotRecorder(),
+        record_click=_DEFAULT_RECORDER,
+        record_scroll=_DEFAULT_RECORDER,
+        record_keyboard=_DEFAULT_RECORDER,
+        record_state=_DEFAULT_RECORDER,
+        stream_to: Optional[Path] = None,
     ):
-        self._record_click = record_click
-        self._record_scroll = record_scroll
-        self._record_keyboard = record_keyboard
-        self._record_state = record_state
+        self._record_click = ClickRecorder() if record_click is _DEFAULT_RECORDER else record_click
+        self._record_scroll = ScrollRecorder() if record_scroll is _DEFAULT_RECORDER else record_scroll
+        self._record_keyboard = KeyboardRecorder() if record_keyboard is _DEFAULT_RECORDER else record_keyboard
+        self._record_state = StateSnapshotRecorder() if record_state is _DEFAULT_RECORDER else record_state
 
         self._mouse_listener = None  # type: Optional[mouse.Listener]
         self._keyboard_listener = None  # type: Optional[keyboard.Listener]
 
-        self._state_snapshot_scheduler = None  # type: Optional[BackgroundScheduler]
+        self._state_snapshot_stop = threading.Event()
+        self._state_snapshot_pending = threading.Event()
+        self._state_snapshot_thread = None  # type: Optional[threading.Thread]
+
+        self._event_queue = queue.SimpleQueue()  # type: queue.SimpleQueue
+        self._event_worker = None  # type: Optional[threading.Thread]
+
+        self.stream_to = stream_to
+        self._events_writer = None  # type: Optional[EventsWriter]
 
         self.recorded_events = Events()
 
@@ -141,30 +330,91 @@ class Recorder:
     def get_events(self) -> Events:
         return self.recorded_events
 
+    def _base_recorders(self) -> List[BaseRecorder]:
+        recorders = (self._record_click, self._record_scroll, self._record_keyboard, self._record_state)
+        return [record for record in recorders if isinstance(record, BaseRecorder)]
+
+    def _process_events(self) -> None:
+        try:
+            while True:
+                item = self._event_queue.get()
+                if item is None:
+                    return
+
+                try:
+                    self._process_event(*item)
+                except Exception:  # pylint: disable=broad-except
+                    # This is the only thread building events, so it must outlive a failure on any single input
+                    logger.exception("Failed to record input %r", item)
+        finally:
+            # Screen grabbers belong to the thread that created them, i.e. this one, which won't be used again
+            for record in self._base_recorders():
+                record.close_screen_grabber()
+
+    def _process_event(self, record, args: tuple, timestamp: datetime) -> None:
+        try:
+            if isinstance(record, BaseRecorder):
+                result = record(*args, self.recorded_events, timestamp=timestamp)
+            else:
+                result = record(*args, self.recorded_events)
+        finally:
+            if record is self._record_state:
+                self._state_snapshot_pending.clear()
+
+        if result is None:
+            return
+
+        if self._events_writer is not None and len(self.recorded_events) > 0:
+            # Nothing more can be merged into the previous event now, so it's complete
+            self._events_writer.write(self.recorded_events[-1])
+            self.clear_recording()
+
+        self.recorded_events.append(result)
+
     def _on_click(self, x: int, y: int, button: Button, is_press: bool):
-        self.recorded_events.append(self._record_click(x, y, button, is_press, self.recorded_events))
+        self._event_queue.put((self._record_click, (x, y, button, is_press), datetime.now()))
 
     def _on_scroll(self, x: int, y: int, dx, dy):
-        result = self._record_scroll(x, y, dx, dy, self.recorded_events)
-        if result is not None:
-            self.recorded_events.append(result)
+        self._event_queue.put((self._record_scroll, (x, y, dx, dy), datetime.now()))
 
     def _take_screenshot(self):
-        result = self._record_state(self.recorded_events)
-        if result is not None:
-            self.recorded_events.append(result)
+        # Like APScheduler's max_instances=1, skip this snapshot if the previous one hasn't been taken yet, so a slow
+        # capture can't build up a backlog of snapshots taken long after their timestamps
+        if self._state_snapshot_pending.is_set():
+            return
+
+        self._state_snapshot_pending.set()
+        self._event_queue.put((self._record_state, (), datetime.now()))
+
+    def _take_screenshots_periodically(self) -> None:
+        period = 1 / self._record_state.frequency
+        next_time = time.monotonic() + period
+        # Schedule from the previous deadline rather than from when the wait ended, so snapshots don't drift later
+        while not self._state_snapshot_stop.wait(max(0.0, next_time - time.monotonic())):
+            self._take_screenshot()
+            # If the wait overran (e.g. the system was suspended), carry on from now instead of firing the missed ticks
+            # back to back
+            next_time = max(next_time + period, time.monotonic())
 
     def _on_key_press(self, key):
-        result = self._record_keyboard(key, True, self.recorded_events)
-        if result is not None:
-            self.recorded_events.append(result)
+        self._event_queue.put((self._record_keyboard, (key, True), datetime.now()))
 
     def _on_key_release(self, key):
-        result = self._record_keyboard(key, False, self.recorded_events)
-        if result is not None:
-            self.recorded_events.append(result)
+        self._event_queue.put((self._record_keyboard, (key, False), datetime.now()))
 
     def record(self) -> None:
+        for record in self._base_recorders():
+            record.reset()
+
+        if self.stream_to is not None:
+            # The last event of any earlier recording was already written when it stopped; it mustn't be written again
+            # (or merged into) by this one
+            self.clear_recording()
+            self._events_writer = EventsWriter(self.stream_to)
+
+        self._event_worker = threading.Thread(target=self._process_events, daemon=True)
+        self._event_worker.start()
+
         mouse_kwargs = {}
 
         if self._record_click:
@@ -182,11 +432,10 @@ class Recorder:
             self._keyboard_listener.start()
 
         if self._record_state is not None:
-            self._state_snapshot_scheduler = BackgroundScheduler()
-            self._state_snapshot_scheduler.add_job(
-                self._take_screenshot, "interval", seconds=1 / self._record_state.frequency
-            )
-            self._state_snapshot_scheduler.start()
+            self._state_snapshot_stop.clear()
+            self._state_snapshot_pending.clear()
+            self._state_snapshot_thread = threading.Thread(target=self._take_screenshots_periodically, daemon=True)
+            self._state_snapshot_thread.start()
 
     def stop(self) -> None:
         if self._mouse_listener is not None:
@@ -195,53 +444,19 @@ class Recorder:
         if self._keyboard_listener is not None:
             self._keyboard_listener.stop()
 
-        if self._state_snapshot_scheduler is not None:
-            self._state_snapshot_scheduler.shutdown()
-
-
-def events_to_actions_using_location(events: Events):
-    actions = []
-    start_time = events[0].timestamp
-    for event in events:
-        start_offset = event.timestamp - start_time
-        if isinstance(event, KeyboardEvent):
-            actions.append(
-                {
-                    "device": event.device,
-                    "start": start_offset,
-                    "key_actions": [
-                        (key, action, action_ts - event.timestamp) for key, action, action_ts in event.key_actions
-                    ],
-                }
-            )
-        elif isinstance(event, ScrollEvent):
-            actions.append(
-                {
-                    "device": event.device,
-                    "start": start_offset,
-                    "action": event.action,
-                    "location": event.location,
-                    "scroll": event.scroll,
-                    "duration": event.last_action_timestamp - event.timestamp,
-                }
-            )
-        elif isinstance(event, ClickEvent):
-            actions.append(
-                {
-                    "device": event.device,
-                    "start": start_offset,
-                    "action": event.action,
-                    "location": event.location,
-                    "button": event.button,
-                }
-            )
-        elif isinstance(event, StateSnapshotEvent):
-            actions.append(
-                {
-                    "device": event.device,
-                    "start": start_offset,
-                    "location": event.location,
-                }
-            )
-        else:
-            raise TypeError(f"Unrecognized event type: {type(event)}")
+        if self._state_snapshot_thread is not None:
+            self._state_snapshot_stop.set()
+            self._state_snapshot_thread.join()
+            self._state_snapshot_thread = None
+
+        if self._event_worker is not None:
+            # Finish building the events for inputs that have already arrived
+            self._event_queue.put(None)
+            self._event_worker.join()
+            self._event_worker = None
+
+        if self._events_writer is not None:
+            if len(self.recorded_events) > 0:
+                self._events_writer.write(self.recorded_events[-1])
+            self._events_writer.close()
+            self._events_writer = None
@@ -0,0 +1,113 @@
+from datetime import datetime, timedelta
+
+import pytest
+from pin_the_tail.location import Point
+from pynput import keyboard
+
+from donkey_see_donkey_do import actions, events
+
+START = datetime(2023, 4, 28, 7, 49, 12)
+
+
+class TestEventsToActionsUsingLocation:
+    @staticmethod
+    def test_returns_one_action_per_event():
+        subject = events.Events.from_iterable(
+            [
+                events.ClickEvent(timestamp=START, action="press", button="left", location=(1, 1)),
+                events.ClickEvent(
+                    timestamp=START + timedelta(seconds=1), action="release", button="left", location=(1, 1)
+                ),
+            ]
+        )
+
+        actual = actions.events_to_actions_using_location(subject)
+
+        assert [action["start"] for action in actual] == [timedelta(0), timedelta(seconds=1)]
+
+    @staticmethod
+    def test_click_event():
+        subject = events.Events.from_iterable(
+            [events.ClickEvent(timestamp=START, action="press", button="left", location=(1, 2))]
+        )
+
+        actual = actions.events_to_actions_using_location(subject)
+
+        assert actual == [
+            {"device": "mouse", "start": timedelta(0), "action": "press", "location": Point(1, 2), "button": "left"}
+        ]
+
+    @staticmethod
+    def test_scroll_event():
+        event = events.ScrollEvent(timestamp=START, location=(1, 2))
+        event.append_action(5, 7, START)
+        event.append_action(0, 3, START + timedelta(seconds=2))
+        subject = events.Events.from_iterable([event])
+
+        actual = actions.events_to_actions_using_location(subject)
+
+        assert actual == [
+            {
+                "device": "mouse",
+                "start": timedelta(0),
+                "action": "scroll",
+                "location": Point(1, 2),
+                "scroll_actions": [
+                    (events.PointChange(5, 7), timedelta(0)),
+                    (events.PointChange(0, 3), timedelta(seconds=2)),
+                ],
+                "duration": timedelta(seconds=2),
+            }
+        ]
+
+    @staticmethod
+    def test_keyboard_event():
+        event = events.KeyboardEvent(timestamp=START)
+        event.append_action(keyboard.Key.shift, "press", START)
+        event.append_action("a", "press", START + timedelta(seconds=1))
+        subject = events.Events.from_iterable([event])
+
+        actual = actions.events_to_actions_using_location(subject)
+
+        assert actual == [
+            {
+                "device": "keyboard",
+                "start": timedelta(0),
+                "key_actions": [(keyboard.Key.shift, "press", timedelta(0)), ("a", "press", timedelta(seconds=1))],
+            }
+        ]
+
+    @staticmethod
+    def test_state_snapshot_event():
+        subject = events.Events.from_iterable(
+            [events.StateSnapshotEvent(timestamp=START, screenshot="screenshot.png", location=(1, 2))]
+        )
+
+        actual = actions.events_to_actions_using_location(subject)
+
+        assert actual == [{"device": "state", "start": timedelta(0), "location": Point(1, 2)}]
+
+    @staticmethod
+    def test_event_subclass_uses_base_class_conversion(monkeypatch):
+        monkeypatch.setattr(actions, "_EVENT_TO_ACTION", dict(actions._EVENT_TO_ACTION))
+
+        class DoubleClickEvent(events.ClickEvent):
+            pass
+
+        subject = events.Events.from_iterable(
+            [DoubleClickEvent(timestamp=START, action="click", button="left", location=(1, 2))]
+        )
+
+        actual = actions.events_to_actions_using_location(subject)
+
+        assert actual == [
+            {"device": "mouse", "start": timedelta(0), "action": "click", "location": Point(1, 2), "button": "left"}
+        ]
+        assert actions._EVENT_TO_ACTION[DoubleClickEvent] is actions._click_event_to_action
+
+    @staticmethod
+    def test_unrecognized_event_type_raises_error():
+        subject = events.Events.from_iterable([events.BaseEvent(timestamp=START)])
+
+        with pytest.raises(TypeError):
+            actions.events_to_actions_using_location(subject)
@@ -1,17 +1,43 @@
+import base64
+import json
+import time
 from datetime import datetime
+from io import BytesIO
 from pathlib import Path
 
 import pytest
 from freezegun import freeze_time
+from PIL import Image
 from pin_the_tail.interaction import MouseButton
 from pin_the_tail.location import Point
 from pydantic import ValidationError
-from pynput import mouse
+from pynput import keyboard, mouse
 
 from donkey_see_donkey_do import events
 from donkey_see_donkey_do.events import PointChange, ScrollChange
 
 
+class TestImageToPng:
+    @staticmethod
+    def test_reuses_encoding_of_same_image():
+        image = Image.new("RGB", (4, 4))
+
+        first = events._image_to_png(image)
+        second = events._image_to_png(image)
+
+        assert first is second
+
+    @staticmethod
+    def test_evicts_encoding_when_image_is_collected():
+        image = Image.new("RGB", (4, 4))
+        key = id(image)
+        events._image_to_png(image)
+
+        del image
+
+        assert key not in events._png_cache
+
+
 class TestStateSnapshotEvent:
     @staticmethod
     def test_sets_device_to_state():
@@ -52,6 +78,20 @@ class TestClickEvent:
 
         assert subject.pin_the_tail_button == expected_instance
 
+    @staticmethod
+    @pytest.mark.parametrize("location", (Point(1, 2), (1, 2), [1, 2]))
+    def test_location_is_converted_to_point(location):
+        subject = events.ClickEvent(action="press", button="left", location=location)
+
+        assert subject.location == Point(1, 2)
+        assert isinstance(subject.location, Point)
+
+    @staticmethod
+    @pytest.mark.parametrize("location", ((1, 2, 3), "1,2"))
+    def test_invalid_location_raises_error(location):
+        with pytest.raises(ValidationError):
+            events.ClickEvent(action="press", button="left", location=location)
+
     @staticmethod
     @pytest.mark.parametrize("action", ("press", "release", "click"))
     def test_action_is_stored(action):
@@ -73,3 +113,230 @@ class TestScrollEvent:
         assert subject.location == Point(1, 1)
         # assert subject.timestamp == frozen_time  # freezegun / pydantic interaction bug: https://github.com/spulec/freezegun/issues/480
         assert subject.scroll_actions == [ScrollChange(PointChange(5, 7), frozen_time)]
+
+    @staticmethod
+    @pytest.mark.parametrize("scroll", ([5, 7], {"dx": 5, "dy": 7}))
+    def test_loading_scroll_actions(scroll):
+        subject = events.ScrollEvent.parse_obj(
+            {"location": (1, 1), "scroll_actions": [{"scroll": scroll, "timestamp": "2023-04-28T07:49:12"}]}
+        )
+
+        assert subject.scroll_actions == [ScrollChange(PointChange(5, 7), datetime(2023, 4, 28, 7, 49, 12))]
+
+    @staticmethod
+    @pytest.mark.parametrize("scroll", (["5", "7"], {"dx": "5", "dy": "7"}))
+    def test_loading_scroll_actions_converts_values_to_int(scroll):
+        subject = events.ScrollEvent.parse_obj(
+            {"location": (1, 1), "scroll_actions": [{"scroll": scroll, "timestamp": "2023-04-28T07:49:12"}]}
+        )
+
+        assert subject.scroll_actions[0].scroll == PointChange(5, 7)
+        assert all(isinstance(value, int) for value in subject.scroll_actions[0].scroll)
+
+    @staticmethod
+    @pytest.mark.parametrize("scroll", (["a", "b"], "57", [5], [5, 7, 9], {"dx": 5}, {"dx": 5, "dy": 7, "dz": 9}, 5))
+    def test_loading_invalid_scroll_actions_raises_error(scroll):
+        with pytest.raises(ValidationError):
+            events.ScrollEvent.parse_obj(
+                {"location": (1, 1), "scroll_actions": [{"scroll": scroll, "timestamp": "2023-04-28T07:49:12"}]}
+            )
+
+
+class TestEvents:
+    @staticmethod
+    def test_from_iterable_keeps_event_instances():
+        click_event = events.ClickEvent(action="press", button="left", location=(1, 1))
+        scroll_event = events.ScrollEvent(location=(1, 1))
+
+        subject = events.Events.from_iterable(iter([click_event, scroll_event]))
+
+        assert len(subject) == 2
+        assert subject[0] is click_event
+        assert subject[1] is scroll_event
+
+    @staticmethod
+    def test_validating_keeps_event_instances():
+        click_event = events.ClickEvent(action="press", button="left", location=(1, 1))
+
+        subject = events.Events(__root__=[click_event])
+
+        assert subject[0] is click_event
+
+    @staticmethod
+    def test_iterating_yields_events():
+        click_event = events.ClickEvent(action="press", button="left", location=(1, 1))
+        scroll_event = events.ScrollEvent(location=(1, 1))
+        subject = events.Events()
+        subject.extend([click_event, scroll_event])
+
+        assert list(subject) == [click_event, scroll_event]
+
+    @staticmethod
+    def test_msgpack_round_trip():
+        screenshot = Image.new("RGB", (4, 4), "red")
+        keyboard_event = events.KeyboardEvent()
+        keyboard_event.append_action(keyboard.Key.shift, "press")
+        keyboard_event.append_action("a", "press")
+        scroll_event = events.ScrollEvent(location=(1, 1), screenshot=screenshot)
+        scroll_event.append_action(5, 7)
+        subject = events.Events()
+        subject.append(events.ClickEvent(action="press", button="left", location=(1, 1)))
+        subject.append(keyboard_event)
+        subject.append(scroll_event)
+
+        actual = events.Events.parse_msgpack(subject.msgpack())
+
+        # Loaded screenshots are PngImageFile instances, which never compare equal to the original image
+        assert [event.dict(exclude={"screenshot"}) for event in actual] == [
+            event.dict(exclude={"screenshot"}) for event in subject
+        ]
+        assert actual[0].screenshot is None
+        assert actual[2].screenshot.size == screenshot.size
+        assert actual[2].screenshot.tobytes() == screenshot.tobytes()
+
+    @staticmethod
+    def test_json_round_trip():
+        keyboard_event = events.KeyboardEvent()
+        keyboard_event.append_action(keyboard.Key.shift, "press")
+        keyboard_event.append_action("a", "press")
+        scroll_event = events.ScrollEvent(location=(1, 1))
+        scroll_event.append_action(5, 7)
+        subject = events.Events()
+        subject.append(events.ClickEvent(action="press", button="left", location=(1, 1)))
+        subject.append(keyboard_event)
+        subject.append(scroll_event)
+
+        actual = events.Events.parse_raw(subject.json())
+
+        assert actual == subject
+
+    @staticmethod
+    def test_loading_untagged_base64_screenshot():
+        image = Image.new("RGB", (4, 4), "red")
+        buffer = BytesIO()
+        image.save(buffer, format="PNG")
+        data = {
+            "timestamp": "2023-04-28T07:49:12",
+            "screenshot": base64.b64encode(buffer.getvalue()).decode("ascii"),
+            "device": "mouse",
+            "location": [1, 1],
+            "action": "press",
+            "button": "left",
+        }
+
+        actual = events.Events.parse_raw(json.dumps([data]))
+
+        assert actual[0].screenshot.tobytes() == image.tobytes()
+
+    @staticmethod
+    def test_to_json_file_round_trip(tmp_path):
+        filepath = tmp_path / "events.json"
+        keyboard_event = events.KeyboardEvent()
+        keyboard_event.append_action(keyboard.Key.shift, "press")
+        subject = events.Events()
+        subject.append(events.ClickEvent(action="press", button="left", location=(1, 1)))
+        subject.append(keyboard_event)
+
+        subject.to_json_file(filepath)
+        actual = events.Events.parse_file(filepath)
+
+        assert actual == subject
+
+    @staticmethod
+    def test_write_json_matches_json():
+        subject = events.Events()
+        for i in range(3):
+            event = events.ClickEvent(
+                action="press", button="left", location=(i, i), screenshot=Image.new("RGB", (4, 4))
+            )
+            subject.append(event)
+        buffer = BytesIO()
+
+        subject.write_json(buffer)
+
+        assert buffer.getvalue().decode("utf-8") == subject.json()
+
+    @staticmethod
+    def test_write_json_does_not_cache_encodings():
+        shared_screenshot = Image.new("RGB", (4, 4), "red")
+        screenshots = [shared_screenshot, Image.new("RGB", (4, 4), "green"), None, Image.new("RGB", (4, 4), "blue")]
+        screenshots.append(shared_screenshot)  # reused beyond the prefetch window of a single worker
+        subject = events.Events()
+        for i, screenshot in enumerate(screenshots):
+            subject.append(events.ClickEvent(action="press", button="left", location=(i, i), screenshot=screenshot))
+        buffer = BytesIO()
+
+        subject.write_json(buffer, max_workers=1)
+
+        assert all(id(screenshot) not in events._png_cache for screenshot in screenshots if screenshot is not None)
+        assert buffer.getvalue().decode("utf-8") == subject.json()
+
+    @staticmethod
+    def test_parse_msgpack_accepts_json():
+        subject = events.Events()
+        subject.append(events.ClickEvent(action="press", button="left", location=(1, 1)))
+
+        actual = events.Events.parse_msgpack(subject.json().encode("utf-8"))
+
+        assert actual == subject
+
+
+class TestEventsWriter:
+    @staticmethod
+    def test_written_events_can_be_loaded(tmp_path):
+        filepath = tmp_path / "events.jsonl"
+        click_event = events.ClickEvent(action="press", button="left", location=(1, 1))
+        keyboard_event = events.KeyboardEvent()
+        keyboard_event.append_action(keyboard.Key.shift, "press")
+
+        with events.EventsWriter(filepath) as subject:
+            subject.write(click_event)
+            subject.write(keyboard_event)
+
+        actual = events.Events.parse_jsonl_file(filepath)
+
+        assert list(actual) == [click_event, keyboard_event]
+
+    @staticmethod
+    def test_written_screenshots_can_be_loaded(tmp_path):
+        filepath = tmp_path / "events.jsonl"
+        image = Image.new("RGB", (4, 4), "red")
+        path_event = events.ClickEvent(
+            action="press", button="left", location=(1, 1), screenshot=tmp_path / "screenshot.png"
+        )
+        image_event = events.ClickEvent(action="release", button="left", location=(1, 1), screenshot=image)
+
+        with events.EventsWriter(filepath) as subject:
+            subject.write(path_event)
+            subject.write(image_event)
+
+        actual = events.Events.parse_jsonl_file(filepath)
+
+        assert actual[0] == path_event
+        assert actual[1].screenshot.tobytes() == image.tobytes()
+
+    @staticmethod
+    def test_flushes_once_max_events_are_pending(tmp_path):
+        filepath = tmp_path / "events.jsonl"
+
+        with events.EventsWriter(filepath, max_events=2, max_interval=60) as subject:
+            subject.write(events.ClickEvent(action="press", button="left", location=(1, 1)))
+            size_after_first_write = filepath.stat().st_size
+            subject.write(events.ClickEvent(action="release", button="left", location=(1, 1)))
+            size_after_second_write = filepath.stat().st_size
+
+        assert size_after_first_write == 0
+        assert size_after_second_write > 0
+
+    @staticmethod
+    def test_flushes_once_max_interval_has_passed_without_more_writes(tmp_path):
+        filepath = tmp_path / "events.jsonl"
+
+        with events.EventsWriter(filepath, max_events=100, max_interval=0.05) as subject:
+            subject.write(events.ClickEvent(action="press", button="left", location=(1, 1)))
+            size_after_write = filepath.stat().st_size
+            time.sleep(0.5)
+            size_after_interval = filepath.stat().st_size
+
+        assert size_after_write == 0
+        assert size_after_interval > 0
@@ -0,0 +1,235 @@
+import sys
+import time
+from unittest import mock
+
+import pytest
+from PIL import Image
+from pynput import mouse
+
+try:
+    import pyautogui  # noqa: F401 pylint: disable=unused-import
+except Exception:  # pylint: disable=broad-except
+    # pyautogui connects to the display as soon as it's imported; these tests never use it
+    sys.modules["pyautogui"] = mock.MagicMock()
+
+from donkey_see_donkey_do import events, recorder  # noqa: E402 pylint: disable=wrong-import-position
+
+
+@pytest.fixture(name="no_listeners")
+def fixture_no_listeners(monkeypatch):
+    monkeypatch.setattr(recorder.mouse, "Listener", mock.MagicMock())
+    monkeypatch.setattr(recorder.keyboard, "Listener", mock.MagicMock())
+
+
+@pytest.fixture(name="fake_mss")
+def fixture_fake_mss(monkeypatch):
+    fake_mss = mock.MagicMock()
+    grabber = fake_mss.mss.return_value
+    grabber.monitors = [{"name": "all monitors"}, {"name": "primary monitor"}]
+    raw = grabber.grab.return_value
+    raw.size = (1, 1)
+    raw.raw = bytearray(4)
+    raw.bgra = bytes(4)
+    raw.rgb = bytes(3)
+    monkeypatch.setattr(recorder, "mss", fake_mss)
+    return fake_mss
+
+
+class TestRecorder:
+    @staticmethod
+    @pytest.mark.usefixtures("no_listeners")
+    def test_failure_to_record_one_input_does_not_stop_recording(caplog):
+        record_click = recorder.ClickRecorder()
+        record_click.get_screenshot = mock.Mock(side_effect=[OSError("screen grab failed"), None, None, None, None])
+        subject = recorder.Recorder(
+            record_click=record_click, record_scroll=None, record_keyboard=None, record_state=None
+        )
+
+        subject.record()
+        for i in range(5):
+            subject._on_click(i, i, mouse.Button.left, True)
+        subject.stop()
+
+        assert [event.location.x for event in subject.get_events()] == [1, 2, 3, 4]
+        assert "screen grab failed" in caplog.text
+
+    @staticmethod
+    @pytest.mark.usefixtures("no_listeners")
+    def test_recorders_can_be_plain_callables():
+        def record_click(x, y, button, is_press, previous_events):
+            return events.ClickEvent.construct(
+                action="press" if is_press else "release", button=button.name, location=(x, y)
+            )
+
+        subject = recorder.Recorder(
+            record_click=record_click, record_scroll=None, record_keyboard=None, record_state=None
+        )
+
+        subject.record()
+        subject._on_click(1, 2, mouse.Button.left, True)
+        subject.stop()
+
+        assert [(event.action, event.location) for event in subject.get_events()] == [("press", (1, 2))]
+
+    @staticmethod
+    @pytest.mark.usefixtures("no_listeners")
+    def test_screen_grabber_captures_primary_monitor_and_is_closed_when_recording_stops(fake_mss):
+        grabber = fake_mss.mss.return_value
+        subject = recorder.Recorder(
+            record_click=recorder.ClickRecorder(), record_scroll=None, record_keyboard=None, record_state=None
+        )
+
+        subject.record()
+        subject._on_click(1, 1, mouse.Button.left, True)
+        subject.stop()
+
+        grabber.grab.assert_called_once_with({"name": "primary monitor"})
+        grabber.close.assert_called_once_with()
+
+    @staticmethod
+    @pytest.mark.usefixtures("no_listeners")
+    def test_slow_state_snapshots_are_skipped_rather_than_queued():
+        def record_state(previous_events):
+            time.sleep(0.1)
+            return events.StateSnapshotEvent.construct(screenshot=None, location=(0, 0))
+
+        record_state.frequency = 50
+        subject = recorder.Recorder(
+            record_click=None, record_scroll=None, record_keyboard=None, record_state=record_state
+        )
+
+        subject.record()
+        time.sleep(0.5)
+        stop_started = time.monotonic()
+        subject.stop()
+        stop_duration = time.monotonic() - stop_started
+
+        # At most one snapshot is waiting when recording stops, rather than the ~20 more that would have been queued
+        assert stop_duration < 1
+        assert len(subject.get_events()) <= 7
+
+    @staticmethod
+    def test_default_recorders_are_not_shared():
+        first = recorder.Recorder()
+        second = recorder.Recorder()
+
+        assert first._record_click is not second._record_click
+        assert first._record_state is not second._record_state
+
+    @staticmethod
+    @pytest.mark.usefixtures("no_listeners")
+    def test_screenshots_are_not_reused_across_recordings(monkeypatch, tmp_path):
+        monkeypatch.setattr(recorder, "mss", None)
+        monkeypatch.setattr(recorder.pyautogui, "screenshot", lambda: Image.new("RGB", (4, 4)))
+        subject = recorder.Recorder(
+            record_click=recorder.ClickRecorder(screenshot_directory=tmp_path, screenshot_max_age=60),
+            record_scroll=None,
+            record_keyboard=None,
+            record_state=None,
+        )
+
+        screenshots = []
+        for _ in range(2):
+            subject.clear_recording()
+            subject.record()
+            subject._on_click(1, 1, mouse.Button.left, True)
+            subject.stop()
+            screenshots.append(subject.get_events()[0].screenshot)
+
+        # The screen didn't change, but each recording saves its own screenshot
+        assert screenshots[0] != screenshots[1]
+        assert all(screenshot.exists() for screenshot in screenshots)
+
+    @staticmethod
+    @pytest.mark.usefixtures("no_listeners")
+    def test_stream_to_writes_each_recording_to_its_file(tmp_path):
+        subject = recorder.Recorder(
+            record_click=recorder.ClickRecorder(take_screenshot=False),
+            record_scroll=None,
+            record_keyboard=None,
+            record_state=None,
+        )
+
+        locations = {"first.jsonl": (1, 2), "second.jsonl": (9,)}
+        for filename, xs in locations.items():
+            subject.stream_to = tmp_path / filename
+            subject.record()
+            for x in xs:
+                subject._on_click(x, x, mouse.Button.left, True)
+            subject.stop()
+
+        for filename, xs in locations.items():
+            actual = events.Events.parse_jsonl_file(tmp_path / filename)
+            assert [event.location.x for event in actual] == list(xs)
+
+
+class TestBaseRecorder:
+    @staticmethod
+    def test_jpeg_screenshots_are_saved_as_jpeg(monkeypatch, tmp_path):
+        monkeypatch.setattr(recorder, "mss", None)
+        monkeypatch.setattr(recorder.pyautogui, "screenshot", lambda: Image.new("RGB", (4, 4), "red"))
+        subject = recorder.ClickRecorder(screenshot_directory=tmp_path, screenshot_format="jpeg")
+
+        actual = subject.get_screenshot()
+
+        assert actual.suffix == ".jpg"
+        with Image.open(actual) as image:
+            assert image.format == "JPEG"
+
+    @staticmethod
+    def test_unsupported_screenshot_format_raises_error():
+        with pytest.raises(ValueError):
+            recorder.ClickRecorder(screenshot_format="gif")
+
+    @staticmethod
+    def test_png_screenshots_are_written_by_mss(fake_mss, tmp_path):
+        raw = fake_mss.mss.return_value.grab.return_value
+        subject = recorder.ClickRecorder(screenshot_directory=tmp_path)
+
+        actual = subject.get_screenshot()
+
+        assert actual.parent == tmp_path
+        assert actual.suffix == ".png"
+        fake_mss.tools.to_png.assert_called_once_with(
+            raw.rgb, raw.size, level=events.PNG_COMPRESS_LEVEL, output=str(actual)
+        )
+
+    @staticmethod
+    def test_jpeg_screenshots_are_encoded_by_pillow_when_using_mss(fake_mss, tmp_path):
+        subject = recorder.ClickRecorder(screenshot_directory=tmp_path, screenshot_format="jpeg")
+
+        actual = subject.get_screenshot()
+
+        fake_mss.tools.to_png.assert_not_called()
+        with Image.open(actual) as image:
+            assert image.format == "JPEG"
+
+    @staticmethod
+    def test_unchanged_screenshots_are_saved_once(monkeypatch, tmp_path):
+        monkeypatch.setattr(recorder, "mss", None)
+        screens = iter([Image.new("RGB", (4, 4)), Image.new("RGB", (4, 4)), Image.new("RGB", (4, 4), "red")])
+        monkeypatch.setattr(recorder.pyautogui, "screenshot", lambda: next(screens))
+        subject = recorder.ClickRecorder(screenshot_directory=tmp_path)
+
+        first = subject.get_screenshot()
+        unchanged = subject.get_screenshot()
+        changed = subject.get_screenshot()
+
+        assert unchanged is first
+        assert changed != first
+        assert sorted(tmp_path.iterdir()) == sorted([first, changed])
+
+    @staticmethod
+    def test_unchanged_screenshots_reuse_the_same_image(monkeypatch):
+        monkeypatch.setattr(recorder, "mss", None)
+        screens = iter([Image.new("RGB", (4, 4)), Image.new("RGB", (4, 4)), Image.new("RGB", (4, 4), "red")])
+        monkeypatch.setattr(recorder.pyautogui, "screenshot", lambda: next(screens))
+        subject = recorder.ClickRecorder()
+
+        first = subject.get_screenshot()
+        unchanged = subject.get_screenshot()
+        changed = subject.get_screenshot()
+
+        assert unchanged is first
+        assert changed is not first
+        assert changed.getpixel((0, 0)) == (255, 0, 0)